@@ -10,6 +10,10 @@ __email__ = "shibaji7@vt.edu"
 __status__ = "Research"
 
 import os
+import re
+import math
+import shutil
+import tarfile
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
@@ -18,26 +22,127 @@ import cv2
 import datetime as dt
 import pandas as pd
 import json
-plt.style.context("seaborn")
-from matplotlib import rcParams
-rcParams["font.family"] = "sans-serif"
+import copy
+import hashlib
+import inspect
+import threading
+import queue
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import astropy.units as u
+from astropy.time import Time
+from astropy.io import fits
 from sunpy.net import Fido, attrs
 import sunpy.map
-from aiapy.calibrate import register, update_pointing, normalize_exposure
+import sunpy.visualization.colormaps as sunpy_cm
+from aiapy.calibrate import register, update_pointing, degradation
+from aiapy.calibrate.util import get_pointing_table
+from aiapy.psf import deconvolve
+try: import drms
+except ImportError: drms = None
+try: import numexpr as ne
+except ImportError: ne = None
+from utils import configure_fonts, fit_to_axes, canvas_to_array
+configure_fonts()
+from deconvolution import bid_deconvolve, deconvolve_dask, psf_fft, parallel_fft, resolve_backend, HAS_DASK
+try:
+    import cupy
+    from cupyx.scipy.ndimage import affine_transform as cupy_affine_transform
+    from sunpy.image.transform import add_rotation_function
 
-import matplotlib.pyplot as plt
-import cv2
-import os
+    @add_rotation_function("cupy", allowed_orders=range(6), handles_clipping=False,
+                           handles_image_nans=False, handles_nan_missing=True)
+    def _rotation_cupy(image, matrix, shift, order, missing, clip):
+        """ Affine transform of aiapy register() computed on the GPU """
+        rotated = cupy_affine_transform(cupy.asarray(image).T, cupy.asarray(matrix), offset=cupy.asarray(shift),
+                                        order=order, mode="constant", cval=missing).T
+        return cupy.asnumpy(rotated)
+    ROTATION_METHOD_GPU = "cupy"
+except ImportError: ROTATION_METHOD_GPU = "scipy"
+
+# CompImageHDU takes the tile as tile_shape from astropy 5.3, as tile_size before
+TILE_KW = "tile_shape" if "tile_shape" in inspect.signature(fits.CompImageHDU.__init__).parameters else "tile_size"
+
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), "sunpy", "cache")
+DATA_FOLDER = os.path.join(os.path.expanduser("~"), "sunpy", "data")
+
+@lru_cache(maxsize=1)
+def list_aia_cache():
+    """ Names of the files in the sunpy data folder, scanned once per process """
+    if not os.path.isdir(DATA_FOLDER): return ()
+    with os.scandir(DATA_FOLDER) as it:
+        return tuple(sorted(e.name for e in it if e.is_file()))
+
+@lru_cache(maxsize=32)
+def pointing_table(hour):
+    """ JSOC pointing table (+/-12h) shared by all images of the same hour """
+    return get_pointing_table(hour - dt.timedelta(hours=12), hour + dt.timedelta(hours=12))
+
+@lru_cache(maxsize=16)
+def _read_config(cfg_file):
+    with open(cfg_file, "r") as fp: return json.load(fp)
+
+def load_config(cfg_file):
+    """ Parameters of a config file, parsed once per process (callers get their own copy) """
+    return copy.deepcopy(_read_config(cfg_file))
+
+@lru_cache(maxsize=64)
+def degradation_factor(wavelength, day):
+    """ Time dependent channel degradation, constant over a day (evaluated at 00:00 UT) """
+    return float(degradation(wavelength*u.angstrom, Time(dt.datetime.combine(day, dt.time()))))
+
+@lru_cache(maxsize=16)
+def sdoaia_cmap(wavelength):
+    """ sunpy AIA colormap of the channel (None if there is none), looked up once """
+    return sunpy_cm.cmlist.get("sdoaia%d"%wavelength)
+
+def search_local(date, wavelength):
+    """ Level-1 file (.fits/_rice.fits) of this wavelength within the 12s window of the date """
+    prefix = "aia_lev1_{:d}a_".format(wavelength)
+    day = prefix + date.strftime("%Y_%m_%d")
+    for name in list_aia_cache():
+        if not name.startswith(day) or not name.endswith(".fits"): continue
+        t = dt.datetime.strptime(name[len(prefix):len(prefix)+19], "%Y_%m_%dt%H_%M_%S")
+        if 0 <= (t - date).total_seconds() <= 12: return os.path.join(DATA_FOLDER, name)
+    return None
+
+def normalized_cache_file(date, wavelength, apply_psf=False, psf_algo="bid", correct_degradation=False, precision="fp16"):
+    """ Normalized map cache keyed by (date, wavelength, psf, degradation, precision) """
+    key = "{}-{}-{}".format(date.isoformat(), wavelength, apply_psf)
+    if apply_psf: key += "-" + psf_algo
+    if correct_degradation: key += "-degradation"
+    ext = ".fits"
+    if precision == "fp16": key, ext = key + "-fp16", ".fits.fz"
+    return os.path.join(CACHE_FOLDER, "normalized_%s%s"%(hashlib.sha1(key.encode()).hexdigest(), ext))
+
+def fetch_aia(date, wavelength):
+    """ Level-1 file of the image: local tile-compressed copy, else downloaded by Fido """
+    local = search_local(date, wavelength)
+    if local is None:
+        q = Fido.search(
+            attrs.Time(date.strftime("%Y-%m-%dT%H:%M:%S"), (date + dt.timedelta(seconds=11)).strftime("%Y-%m-%dT%H:%M:%S")),
+            attrs.Instrument("AIA"),
+            attrs.Wavelength(wavemin=wavelength*u.angstrom, wavemax=wavelength*u.angstrom),
+        )
+        local = RegisterAIA.compress(Fido.fetch(q[0,0])[0])
+    return local
 
 class RegisterAIA(object):
     
-    def __init__(self, date, wavelength=193, resolution=1024, vmin=10):
+    def __init__(self, date, wavelength=193, resolution=1024, vmin=10, apply_psf=False, psf_algo="bid", use_gpu=False,
+                 backend="auto", precision="fp16", correct_degradation=False):
         self.wavelength = wavelength
         self.date = date
         self.resolution = resolution
         self.vmin = vmin
+        self.apply_psf = apply_psf
+        self.correct_degradation = correct_degradation
+        self.psf_algo = psf_algo
+        self.use_gpu = use_gpu
+        self.backend = resolve_backend(backend, use_gpu)
+        self.precision = precision
+        self._m, self._m_normalized = None, None
         self.folder = "data/SDO-Database/{:4d}.{:02d}.{:02d}/{:04d}/{:03d}/".format(self.date.year, self.date.month, self.date.day,
                                                                              self.resolution, self.wavelength)
         self.fname = "{:4d}_{:02d}_{:02d}_{:02d}{:02d}{:02d}.png".format(self.date.year, self.date.month,
@@ -49,42 +154,282 @@ class RegisterAIA(object):
             #self.to_png()
         return
     
+    @property
+    def m(self):
+        """ Raw level-1 map, only read (or downloaded) on first access """
+        if self._m is None: self.fetch()
+        return self._m
+    
+    @property
+    def m_normalized(self):
+        """ Normalized map, built (or read from the cache) on first access """
+        if self._m_normalized is None: self.normalized()
+        return self._m_normalized
+    
     def normalized(self):
-        q = Fido.search(
-            attrs.Time(self.date.strftime("%Y-%m-%dT%H:%M:%S"), (self.date + dt.timedelta(seconds=11)).strftime("%Y-%m-%dT%H:%M:%S")),
-            attrs.Instrument("AIA"),
-            attrs.Wavelength(wavemin=self.wavelength*u.angstrom, wavemax=self.wavelength*u.angstrom),
-        )
-        self.m = sunpy.map.Map(Fido.fetch(q[0,0]))
-        m_updated_pointing = update_pointing(self.m)
-        m_registered = register(m_updated_pointing)
-        self.m_normalized = normalize_exposure(m_registered)
+        """ Register and normalize the image; on a cache hit the raw image is never touched """
+        cache = self.cache_file()
+        if os.path.exists(cache): self._m_normalized = self.load_normalized(cache)
+        else:
+            self.calibrate()
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            self.save_normalized(cache)
+        self.fetch_solar_parameters()
         return
     
+    def save_normalized(self, cache):
+        """
+        fp32: plain FITS. fp16: the float16 bit pattern is stored as int16 in a RICE tile-compressed
+        HDU (lossless for the float16 values, half the size of the float32 map). Images beyond the
+        float16 range (65504) are stored as float32 instead. The map continues with the cached
+        values, so the first run gives the same result as the later (cache hit) ones.
+        """
+        if self.precision == "fp16":
+            header = fits.Header(self._m_normalized.fits_header)
+            for k in ["BSCALE", "BZERO", "BLANK"]: header.remove(k, ignore_missing=True)
+            data = np.asarray(self._m_normalized.data)
+            data16 = data.astype(np.float16)
+            if np.any(~np.isfinite(data16) & np.isfinite(data)):
+                data = data.astype(np.float32)
+                hdu = fits.ImageHDU(data, header)
+            else:
+                hdu = fits.CompImageHDU(data16.view(np.int16), header, compression_type="RICE_1")
+                hdu.header["CHIPSF16"] = (True, "int16 data holds float16 values")
+                data = data16.astype(np.float32)
+            fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(cache, overwrite=True)
+            self._m_normalized = sunpy.map.Map(data, self._m_normalized.meta)
+        else: self._m_normalized.save(cache, overwrite=True)
+        return
+    
+    @staticmethod
+    def load_normalized(cache):
+        """
+        Normalized map from the cache with a single FITS parse: fp32 data stays memory-mapped,
+        float16 payloads are upcast to float32
+        """
+        with fits.open(cache, memmap=True, do_not_scale_image_data=True) as hdul:
+            hdu = hdul[-1]
+            if hdu.header.get("CHIPSF16", False): data = hdu.data.view(np.float16).astype(np.float32)
+            else: data = hdu.data.view(np.ndarray)
+            m = sunpy.map.Map(data, hdu.header.copy())
+        return m
+    
+    def cache_file(self):
+        """ Cache file of the normalized map of this image """
+        return normalized_cache_file(self.date, self.wavelength, self.apply_psf, self.psf_algo,
+                                     self.correct_degradation, self.precision)
+    
+    def fetch(self):
+        """ Raw level-1 map: local tile-compressed copy, else downloaded by Fido """
+        self._m = sunpy.map.Map(fetch_aia(self.date, self.wavelength))
+        return
+    
+    def search_local(self):
+        """ Local level-1 file of this image, None if it has to be downloaded """
+        return search_local(self.date, self.wavelength)
+    
+    @staticmethod
+    def compress(f):
+        """
+        Store the level-1 file RICE tile-compressed as _rice.fits (JSOC files already are and are kept).
+        The .fits suffix is kept: sunpy picks the reader by extension and reads .fz as ANA.
+        """
+        out = f
+        with fits.open(f, do_not_scale_image_data=True) as hdul:
+            hdu = hdul[-1]
+            if not isinstance(hdu, fits.CompImageHDU):
+                out = f[:-len(".fits")] + "_rice.fits"
+                fits.CompImageHDU(hdu.data, hdu.header, compression_type="RICE_1",
+                                  **{TILE_KW: (512, 512)}).writeto(out, overwrite=True)
+        if out != f: os.remove(f)
+        list_aia_cache.cache_clear()
+        return out
+    
+    def calibrate(self):
+        m_deconvolved = self.deconvolve(self.m) if self.apply_psf else self.m
+        hour = self.date.replace(minute=0, second=0, microsecond=0)
+        m_updated_pointing = update_pointing(m_deconvolved, pointing_table=pointing_table(hour))
+        # Older aiapy/sunpy have no rotation `method`, it is only passed for the cupy hook
+        if self.backend == "cupy" and ROTATION_METHOD_GPU == "cupy": m_registered = register(m_updated_pointing, method="cupy")
+        else: m_registered = register(m_updated_pointing)
+        self._m_normalized = self.normalize(m_registered)
+        return
+    
+    def normalize(self, m):
+        """
+        Exposure normalization (and degradation correction) of the registered map as a single
+        scaling pass over the data, numexpr evaluated when available
+        """
+        k = 1. / m.exposure_time.to(u.s).value
+        if self.correct_degradation: k /= degradation_factor(self.wavelength, self.date.date())
+        data = ne.evaluate("data*k", local_dict={"data": m.data, "k": k}) if ne is not None else m.data * k
+        meta = m.meta.copy()
+        meta["exptime"] = 1.0
+        meta["bunit"] = "DN/s"
+        return sunpy.map.Map(data, meta)
+    
+    def fetch_solar_parameters(self):
+        """ Solar disk parameters from the normalized map """
+        meta = self.m_normalized.meta
+        self.rscale = float(meta["cdelt2"])
+        self.r_sun = float(meta["r_sun"])
+        self.rsun_obs = float(meta["rsun_obs"])
+        self.pixel_radius = int(self.rsun_obs / self.rscale * self.resolution / meta["naxis1"])
+        return
+    
+    def deconvolve(self, m):
+        """
+        Deconvolve the instrument PSF: BID (Fourier-domain), BID over overlapping dask tiles on
+        the CPU ("bid-dask", not identical to the full frame BID) or aiapy Richardson-Lucy ("rl")
+        """
+        if self.psf_algo == "bid-dask":
+            if not HAS_DASK: raise ImportError("psf_algo='bid-dask' needs dask")
+            m = sunpy.map.Map(deconvolve_dask(m.data, self.wavelength), m.meta)
+        elif self.psf_algo == "bid":
+            data = bid_deconvolve(m.data, psf_fft(self.wavelength, m.data.shape, self.backend), backend=self.backend)
+            m = sunpy.map.Map(data, m.meta)
+        else:
+            if self.backend == "cupy": m = deconvolve(m, use_gpu=True)
+            else:
+                with parallel_fft(): m = deconvolve(m, use_gpu=False)
+        return m
+    
+    _figure_lock = threading.Lock()
+    
+    @classmethod
+    @lru_cache(maxsize=4)
+    def _get_figure(cls, figsize, dpi, nrows=1, ncols=1):
+        """ One figure per layout, reused by every to_png call """
+        return plt.subplots(nrows=nrows, ncols=ncols, dpi=dpi, figsize=figsize)
+    
     def to_png(self):
-        norm, m = self.m_normalized, self.m
-        fig, ax = plt.subplots(nrows=1,ncols=1,dpi=100,figsize=(2048/100, 2048/100))
-        norm.plot(annotate=False, axes=ax, vmin=self.vmin)
-        ax.set_xticks([])
-        ax.set_yticks([])
-        fig.savefig("tmp.png",bbox_inches="tight")
-        im = cv2.imread("tmp.png")
-        im = im[10:-10,10:-10]
+        norm = self.m_normalized
+        with self._figure_lock:
+            fig, ax = self._get_figure((2048/100, 2048/100), 100)
+            ax.clear()
+            cmap = sdoaia_cmap(self.wavelength)
+            if cmap is None: norm.plot(annotate=False, axes=ax, vmin=self.vmin)
+            else: norm.plot(annotate=False, axes=ax, vmin=self.vmin, cmap=cmap)
+            ax.set_xticks([])
+            ax.set_yticks([])
+            # Axes area of the rendered canvas, no tmp.png round trip
+            im = canvas_to_array(fig, ax)
         im = cv2.resize(im, (self.resolution, self.resolution))
-        os.remove("tmp.png")
         cv2.imwrite(self.folder + self.fname, im)
         return
 
+class AIADatasets(object):
+    """ RegisterAIA over all wavelengths/resolutions of a date, fetched concurrently """
+    
+    def __init__(self, date, wavelengths=[193], resolutions=[1024], vmin=10, apply_psf=False, psf_algo="bid", use_gpu=False,
+                 backend="auto", precision="fp16", correct_degradation=False, jsoc_email=None):
+        self.date = date
+        self.wavelengths = wavelengths
+        self.resolutions = resolutions
+        if jsoc_email is not None: self.export_jsoc([date], wavelengths, jsoc_email)
+        self.datasets = dict([(wv, {}) for wv in wavelengths])
+        # Disk parameters as struct-of-arrays, one slot per (wv, res) in wavelength-major order
+        n = len(wavelengths)*len(resolutions)
+        self._meta_index = dict([((wv, res), i*len(resolutions) + j) for i, wv in enumerate(wavelengths)
+                                 for j, res in enumerate(resolutions)])
+        self._meta_soa = dict([(k, np.full(n, np.nan)) for k in ["rscale", "r_sun", "rsun_obs"]])
+        self._meta_soa["pixel_radius"] = np.zeros(n, dtype=np.int32)
+        with ThreadPoolExecutor(max_workers=len(wavelengths)) as ex:
+            futures = dict([(ex.submit(self.register, wv, vmin, apply_psf, psf_algo, use_gpu, backend, precision,
+                                        correct_degradation), wv) for wv in wavelengths])
+            for f in as_completed(futures):
+                wv = futures[f]
+                self.datasets[wv] = f.result()
+                for res in self.resolutions: self.set_meta(wv, res, self.datasets[wv][res])
+        return
+    
+    @classmethod
+    def series(cls, dates, wavelengths=[193], **kwargs):
+        """
+        AIADatasets of consecutive dates as a two stage pipeline: a producer thread downloads the raw
+        images of the next dates (at most two ahead) while the current date is being calibrated.
+        With jsoc_email, the images of all the dates are first requested in a single JSOC export.
+        """
+        dates = list(dates)
+        jsoc_email = kwargs.pop("jsoc_email", None)
+        if jsoc_email is not None: cls.export_jsoc(dates, wavelengths, jsoc_email)
+        cache_kw = dict([(k, kwargs[k]) for k in ["apply_psf", "psf_algo", "correct_degradation", "precision"]
+                         if k in kwargs])
+        pending = queue.Queue(maxsize=2)
+        def produce():
+            for d in dates:
+                for wv in wavelengths:
+                    try:
+                        if not os.path.exists(normalized_cache_file(d, wv, **cache_kw)): fetch_aia(d, wv)
+                    except Exception: pass # fetched again, and reported, by the consumer
+                pending.put(d)
+            pending.put(None)
+        threading.Thread(target=produce, daemon=True).start()
+        for d in iter(pending.get, None): yield cls(d, wavelengths, **kwargs)
+    
+    @staticmethod
+    def export_jsoc(dates, wavelengths, email):
+        """
+        One drms url-tar export for every (date, wavelength) image missing from the sunpy data folder,
+        instead of a Fido export/poll/download per image. Files are stored with the sunpy names,
+        so RegisterAIA.fetch finds them with search_local. Returns the number of files added.
+        """
+        if drms is None: raise ImportError("AIADatasets.export_jsoc needs drms")
+        missing = [(d, wv) for d in dates for wv in wavelengths if search_local(d, wv) is None]
+        if len(missing) == 0: return 0
+        times = ",".join(sorted(set([d.strftime("%Y-%m-%dT%H:%M:%SZ/12s") for d, _ in missing])))
+        wvs = ",".join(sorted(set([str(wv) for _, wv in missing])))
+        r = drms.Client().export("aia.lev1_euv_12s[%s][%s]{image}"%(times, wvs), method="url-tar",
+                                 protocol="fits", email=email)
+        r.wait()
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        tar = r.download(DATA_FOLDER).download[0]
+        pattern = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2})(\d{2})(\d{2})Z\.(\d+)\.image")
+        n = 0
+        with tarfile.open(tar) as tf:
+            for member in tf.getmembers():
+                g = pattern.search(member.name)
+                if g is None or not member.isfile(): continue
+                name = "aia_lev1_{6}a_{0}_{1}_{2}t{3}_{4}_{5}_00z_image_lev1.fits".format(*g.groups())
+                f = os.path.join(DATA_FOLDER, name)
+                with tf.extractfile(member) as src, open(f, "wb") as dst: shutil.copyfileobj(src, dst, length=1<<20)
+                RegisterAIA.compress(f)
+                n += 1
+        os.remove(tar)
+        return n
+    
+    def register(self, wavelength, vmin, apply_psf, psf_algo, use_gpu, backend, precision, correct_degradation):
+        """ Resolutions of one wavelength share the raw file, so they run in the same worker """
+        disks = {}
+        for res in self.resolutions:
+            disks[res] = RegisterAIA(self.date, wavelength, res, vmin, apply_psf, psf_algo, use_gpu, backend, precision,
+                                      correct_degradation)
+        return disks
+    
+    def set_meta(self, wavelength, resolution, disk):
+        """ Write the disk parameters into the (wv, res) slot of the metadata arrays """
+        if not hasattr(disk, "rscale"): disk.fetch_solar_parameters()
+        i = self._meta_index[(wavelength, resolution)]
+        for k in self._meta_soa.keys(): self._meta_soa[k][i] = getattr(disk, k)
+        return
+    
+    def get_meta(self, key, wavelength=None):
+        """ Metadata array over all disks, or a contiguous view over the resolutions of one wavelength """
+        arr = self._meta_soa[key]
+        if wavelength is not None:
+            i = self.wavelengths.index(wavelength)*len(self.resolutions)
+            arr = arr[i:i+len(self.resolutions)]
+        return arr
+
 class Chips(object):
     """ Edge detection by Open-CV """
     
     def __init__(self, filename, folder, _dict_, cfg_file = "data/config/{:3d}.json"):
         np.random.seed(0)
         cfg_file = cfg_file.format(_dict_["wavelength"])
-        with open(cfg_file, "r") as fp:
-            dic = json.load(fp)
-            for p in dic.keys():
-                if not hasattr(self, p): setattr(self, p, dic[p])
+        dic = load_config(cfg_file)
+        for p in dic.keys():
+            if not hasattr(self, p): setattr(self, p, dic[p])
         for p in _dict_.keys():
             setattr(self, p, _dict_[p])
         self.filename = filename
@@ -139,7 +484,7 @@ class Chips(object):
         d = self.radius
         try:
             center = self.get_center(contour)
-            d = np.sqrt((self.center[0]-center[0])**2+(self.center[1]-center[1])**2)
+            d = math.hypot(int(self.center[0])-center[0], int(self.center[1])-center[1])
         except: print(" distance: Div by (0)")
         return d
     
@@ -262,14 +607,19 @@ class Chips(object):
                 self.extract_informations(self.contours[int(ix)])
         return prob
     
+    def disk_circle(self):
+        """ Area and perimeter of the solar disk contour, the same for every CH of the image """
+        if not hasattr(self, "_disk_circle"):
+            circle = np.zeros_like(self.images["gray"])
+            cv2.circle(circle, self.center, self.radius-self.delta, (255,255,255), -1)
+            _, thrs = cv2.threshold(circle, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+            cntrs, _ = cv2.findContours(thrs, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+            self._disk_circle = (cv2.contourArea(cntrs[0]), cv2.arcLength(cntrs[0],True))
+        return self._disk_circle
+    
     def extract_informations(self, contour):
         self.contour_infos[self.write_id_index] = {}
-        circle = np.zeros_like(self.images["gray"])
-        cv2.circle(circle, self.center, self.radius-self.delta, (255,255,255), -1)
-        _, thrs = cv2.threshold(circle, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-        cntrs, _ = cv2.findContours(thrs, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        c_area = cv2.contourArea(cntrs[0])
-        c_perim = cv2.arcLength(cntrs[0],True)
+        c_area, c_perim = self.disk_circle()
         self.contour_infos[self.write_id_index]["area"] = np.round(cv2.contourArea(contour)/(c_area),2)
         self.contour_infos[self.write_id_index]["d"] = np.round(self.distance(contour)/self.resolution,2)
         self.contour_infos[self.write_id_index]["perim"] = np.round(cv2.arcLength(contour,True)/c_perim,2)
@@ -296,15 +646,11 @@ class Chips(object):
                   "d. Masked:HC", "e. Threshold: OTSU", "f. Conturs", 
                   r"g. $\mathcal{F}\left(I^C> %d\right)\geq %.2f$"%(self.intensity_threshold, self.intensity_prob_threshold), 
                   "h. Detected CHB"]
+        panels = [("org", False), ("gray_hc", True), ("blur", True), ("blur_mask", True), ("inv", True),
+                  ("src_olc", False), ("prob_masked_gray_image", True), ("prob_masked_image", False)]
         fig, axes = plt.subplots(dpi=180, figsize=(5, 10), nrows=4, ncols=2)
-        self.set_axes(axes[0,0], self.images["org"], titles[0])
-        self.set_axes(axes[0,1], self.images["gray_hc"], titles[1], True)
-        self.set_axes(axes[1,0], self.images["blur"], titles[2], True)
-        self.set_axes(axes[1,1], self.images["blur_mask"], titles[3], True)
-        self.set_axes(axes[2,0], self.images["inv"], titles[4], True)
-        self.set_axes(axes[2,1], self.images["src_olc"], titles[5])
-        self.set_axes(axes[3,0], self.images["prob_masked_gray_image"], titles[6], True)
-        self.set_axes(axes[3,1], self.images["prob_masked_image"], titles[7])
+        for ax, (key, gray_map), title in zip(axes.ravel().tolist(), panels, titles):
+            self.set_axes(ax, self.images[key], title, gray_map)
         fig.subplots_adjust(hspace=0.5, wspace=0.5)
         fig.savefig(self.folder + self.filename.replace(self.extn, "_analysis" + self.extn), bbox_inches="tight")
         return
@@ -313,8 +659,9 @@ class Chips(object):
         ax.set_ylabel("Y (arcsec)", fontdict={"size":10})
         ax.set_xlabel("X (arcsec)", fontdict={"size":10})
         ax.set_title(title, fontdict={"size":10})
-        if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray")
-        else: ax.imshow(image, extent=[-1024,1024,-1024,1024])
+        image = fit_to_axes(image, ax)
+        if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray", interpolation="nearest", rasterized=True)
+        else: ax.imshow(image, extent=[-1024,1024,-1024,1024], interpolation="nearest", rasterized=True)
         ax.tick_params(axis="both", which="major", labelsize=8)
         ax.set_xticks([-1024,-512,0,512,1024])
         ax.set_yticks([-1024,-512,0,512,1024])
@@ -322,7 +669,7 @@ class Chips(object):
     
     def masked_image(self):
         fig, ax = plt.subplots(dpi=120, figsize=(5, 5))
-        self.set_axes(ax, self.rescale(self.images["contours"], 4096), "", True)
+        self.set_axes(ax, self.images["contours"], "", True)
         ax.text(-1024, 1072, "Detected CHB (AIA %d)"%self.wavelength, ha="left", va="center", fontdict={"size":10, "color":"r"})
         if self.write_id: ax.text(1024, 1072, self.to_info_str(1), ha="right", va="center", fontdict={"size":10, "color":"b"})
         ax.text(1.03, 0.5, self.date.strftime("%Y-%m-%d %H:%M:%S UT"), 
@@ -338,7 +685,7 @@ class Chips(object):
     
     def final_image(self):
         fig, ax = plt.subplots(dpi=120, figsize=(5, 5))
-        self.set_axes(ax, self.rescale(self.images["prob_masked_image"], 4096), "")
+        self.set_axes(ax, self.images["prob_masked_image"], "")
         ax.text(-1024, 1072, "Detected CHB (AIA %d)"%self.wavelength, ha="left", va="center", fontdict={"size":10, "color":"r"})
         if self.write_id: ax.text(1024, 1072, self.to_info_str(1), ha="right", va="center", fontdict={"size":10, "color":"b"})
         ax.text(1.03, 0.5, self.date.strftime("%Y-%m-%d %H:%M:%S UT"), 
@@ -19,9 +19,8 @@ import datetime as dt
 import pandas as pd
 import json
 from scipy.stats import beta
-plt.style.context("seaborn")
-from matplotlib import rcParams
-rcParams["font.family"] = "sans-serif"
+from utils import configure_fonts, fit_to_axes, get_cmap, save_fast
+configure_fonts()
 
 import matplotlib.pyplot as plt
 import cv2
@@ -42,52 +41,76 @@ class ProbabilisticContours(object):
         if os.path.exists(self.binfile): 
             self.binmaps = cv2.imread(cv2.samples.findFile(self.binfile), cv2.IMREAD_GRAYSCALE)
             self.fcontours = (self.binmaps > 0).astype(int)
-            if os.path.exists(self.aia.folder + self.aia.fname): self.aia.normalized()
             self.norm_data = self.aia.m_normalized.data * self.fcontours
-            self.fcontours_nan = np.copy(self.fcontours).astype(float)
-            self.fcontours_nan[self.fcontours_nan == 0] = np.nan
+            self.fcontours_nan = np.where(self.fcontours > 0, 1., np.nan)
+            self._prob_cache = {}
         else: raise Exception("File does not exists:", self.binfile)
         return
     
-    def probability_contours(self, v_range=(10, 300), v_step=10, pth=0.5, summary=True):
-        _dict_ = {}
-        for thd in range(v_range[0], v_range[1], v_step):
-            _data = self.norm_data * self.fcontours_nan
-            _intensity = (thd - _data).ravel()
-            _intensity = _intensity[~np.isnan(_intensity)]
+    def probability_contours(self, v_range=(10, 300), v_step=10, pth=0.5, summary=True, fast_save=False):
+        key = (tuple(v_range), v_step, pth)
+        if key not in self._prob_cache: self._prob_cache[key] = self._probability_contours(v_range, v_step, pth)
+        self.thresholds, self.probs, self.masks = self._prob_cache[key]
+        _dict_ = dict([(thd, (p, m)) for thd, p, m in zip(self.thresholds, self.probs, self.masks)])
+        if summary: self.generate_analysis_summary("norm", _dict_, fast_save)
+        return _dict_
+    
+    def _probability_contours(self, v_range, v_step, pth):
+        """
+        Thresholds, F(x_tau, I_th) and the binary masks as parallel arrays, masks stacked in
+        one (N, H, W) uint8 array; the in-contour intensities are extracted once
+        """
+        thresholds = np.arange(v_range[0], v_range[1], v_step)
+        probs = np.zeros(len(thresholds))
+        masks = np.zeros((len(thresholds),) + self.norm_data.shape, dtype=np.uint8)
+        _data = (self.norm_data * self.fcontours_nan).ravel()
+        _data = _data[~np.isnan(_data)]
+        for i, thd in enumerate(thresholds):
+            _intensity = thd - _data
             _probs =  1./(1.+np.exp(_intensity))
             _hist, _bin_edges = np.histogram(_probs, bins=np.linspace(0,1,21), density=True)
             _idx = np.diff(_bin_edges)
             _f = pd.DataFrame(); _f["pr"], _f["edgs"], _f["idx"] = _hist, _bin_edges[:-1], _idx
             _f = _f[_f.edgs >= pth]
-            _mask = (self.norm_data <= thd).astype(int) * self.fcontours
-            _dict_[thd] = (np.sum(_f.idx*_f.pr), _mask)
-        if summary: self.generate_analysis_summary("norm", _dict_)
-        return _dict_
+            np.logical_and(self.norm_data <= thd, self.fcontours > 0, out=masks[i], casting="unsafe")
+            probs[i] = np.sum(_f.idx*_f.pr)
+        return thresholds, probs, masks
     
     def probability_contours_with_intensity_operation(self, v_range=(10, 300), v_step=10, pth=0.5,                                                       operations={"name":r"Logarithm: $10\times$ $log_{10}(x)$","fn":lambda x: 10*np.log10(x)}):
         _dict_ = {}
         
         return
     
-    def generate_analysis_summary(self, kind="norm", _dict_ = {}):
+    def generate_analysis_summary(self, kind="norm", _dict_ = {}, fast_save=False):
         """
         Plot histograms for normalized intensity, thresholds and other parameters
+        fast_save: PNG panels are written from the Agg buffer (untrimmed margins)
         """
         summary_folder = self.folder + "summary/"
         if not os.path.exists(summary_folder): os.mkdir(summary_folder)
         if kind=="norm": norm_data = np.copy(self.norm_data)
+        # One figure and AxesImage for all the panels, only the data and title change
+        fig, ax = plt.subplots(dpi=180, figsize=(4,4), nrows=1, ncols=1)
+        im = ax.imshow(np.zeros((2, 2)), extent=[-1024,1024,-1024,1024], cmap=get_cmap("gray"), vmin=0, vmax=1, interpolation="nearest", rasterized=True)
+        self.set_axes(ax)
         for key in _dict_.keys():
             _p, _mask = _dict_[key]
-            fig, ax = plt.subplots(dpi=180, figsize=(4,4), nrows=1, ncols=1)
-            ax.imshow(_mask*255, extent=[-1024,1024,-1024,1024], cmap="gray")
-            ax.set_xticks([-1024,-512,0,512,1024])
-            ax.set_yticks([-1024,-512,0,512,1024])
-            ax.set_xticklabels([r"-$2^{10}$",r"-$2^{9}$","0",r"$2^{9}$",r"$2^{10}$"])
-            ax.set_yticklabels([r"-$2^{10}$",r"-$2^{9}$","0",r"$2^{9}$",r"$2^{10}$"])
-            ax.tick_params(axis="both", which="major", labelsize=8)
+            im.set_data(fit_to_axes(_mask, ax))
             ax.set_title(r"$\mathcal{F}(x_{\tau},I_{th})$=%.3f, $x_{\tau}$=0.5, $I_{th}$=%d"%(_p,key), fontdict={"size":8})
-            fig.savefig(summary_folder + self.filename.replace(self.extn, "_binmaps_%04d"%key + self.extn), bbox_inches="tight")
-            plt.close()
+            self.save(fig, summary_folder + self.filename.replace(self.extn, "_binmaps_%04d"%key + self.extn), fast_save)
+        plt.close(fig)
         os.system("zip -r summary.zip " + summary_folder)
+        return
+    
+    def save(self, fig, fname, fast_save=False):
+        if fast_save and fname.endswith(".png"): save_fast(fig, fname)
+        else: fig.savefig(fname, bbox_inches="tight")
+        return
+    
+    def set_axes(self, ax):
+        ax.set_xticks([-1024,-512,0,512,1024])
+        ax.set_yticks([-1024,-512,0,512,1024])
+        ax.set_xticklabels([r"-$2^{10}$",r"-$2^{9}$","0",r"$2^{9}$",r"$2^{10}$"])
+        ax.set_yticklabels([r"-$2^{10}$",r"-$2^{9}$","0",r"$2^{9}$",r"$2^{10}$"])
+        ax.tick_params(axis="both", which="major", labelsize=8)
         return
\ No newline at end of file
@@ -30,6 +30,7 @@ import torch.nn.init
 import random
 import os
 import json
+from utils import fit_to_axes, get_cmap
 
 _params_ = {
     "_desc": "PyTorch Unsupervised Segmentation",
@@ -52,6 +53,19 @@ import matplotlib.pyplot as plt
 import cv2
 import os
 
+def hist_quantile(im, qs, nbins=256):
+    """
+    np.quantile (linear interpolation) of an 8-bit image from its histogram: one O(N) pass
+    instead of a sort, the order statistics around each quantile are read off the cumulative counts
+    """
+    counts = np.cumsum(np.bincount(im.ravel(), minlength=nbins))
+    h = (im.size - 1) * np.asarray(qs, dtype=float)
+    lo = np.floor(h).astype(np.int64)
+    hi = np.minimum(lo + 1, im.size - 1)
+    v_lo = np.searchsorted(counts, lo, side="right")
+    v_hi = np.searchsorted(counts, hi, side="right")
+    return v_lo + (h - lo) * (v_hi - v_lo)
+
 class RegisterAIA(object):
     
     def __init__(self, date, wavelength=193, resolution=1024, vmin=10):
@@ -257,9 +271,8 @@ class Loader(object):
             output = output.permute(1, 2, 0).contiguous().view(-1, self.params.nChannel)
             ignore, target = torch.max(output, 1)
             self.im_target = target.data.cpu().numpy()
-            self.unique_targets = np.array([self.label_colours[c % 100] for c in np.unique(self.im_target)])
-            self.im_target_rgb = np.array([self.label_colours[c % 100] for c in self.im_target])
-            self.im_target_rgb = self.im_target_rgb.reshape(self.im.shape).astype(np.uint8)
+            self.unique_targets = self.label_colours[np.unique(self.im_target) % 100]
+            self.im_target_rgb = self.label_colours[self.im_target % 100].reshape(self.im.shape).astype(np.uint8)
             cv2.imwrite(self.folder + self.fname.replace(self.extn, "_seg" + self.extn), self.im_target_rgb)
         return self
     
@@ -268,18 +281,19 @@ class Loader(object):
         ints = False
         gray = np.copy(self.images["gray"])
         gray = cv2.bitwise_and(gray, gray, mask=mask)
-        if np.quantile(gray.ravel(), 0.05) >= 0 and np.quantile(gray.ravel(), 0.95) <= 100: ints = True
+        q05, q95 = hist_quantile(gray, [0.05, 0.95])
+        if q05 >= 0 and q95 <= 100: ints = True
         return ints
     
     def estimate_CHB(self):
         if not os.path.exists(self.folder + self.fname.replace(self.extn, "_msk" + self.extn)):
-            maskList = []
+            # Running in-place sum of the accepted masks, no (N, H, W) stack
+            self.totalmask = np.zeros_like(self.images["hc_mask"], dtype=np.uint64)
             for targ in self.unique_targets:
                 mask = cv2.inRange(self.im_target_rgb, targ-1, targ+1)
                 mask = cv2.bitwise_and(mask, mask, mask=self.images["hc_mask"])
                 if np.count_nonzero(mask) < 0.1*self.NzC and self.check_intensity(mask):
-                    maskList.append(mask)
-            self.totalmask = np.array(maskList).sum(axis=0)
+                    np.add(self.totalmask, mask, out=self.totalmask)
             cv2.imwrite(self.folder + self.fname.replace(self.extn, "_msk" + self.extn), self.totalmask)
         else:
             fname = self.folder + self.fname.replace(self.extn, "_msk" + self.extn)
@@ -326,19 +340,19 @@ class Loader(object):
         maskplot = cv2.applyColorMap(maskplot, cv2.COLORMAP_JET)
         cv2.imwrite(self.folder + self.fname.replace(self.extn, "_stg1.1_out" + self.extn), maskplot)
         self.plot_image_dev(self.images["prob_masked_image_ol"], linked_list)
-        self.plot_image_dev(maskplot, linked_list, cmap=mpl.cm.jet, ext="_cb_jet")
+        self.plot_image_dev(maskplot, linked_list, cmap="jet", ext="_cb_jet")
         return self
     
-    def plot_image_dev(self, image, objs, shape=(15,14), cmap=mpl.cm.gray, ext="_cb_gray"):
+    def plot_image_dev(self, image, objs, shape=(15,14), cmap="gray", ext="_cb_gray"):
         df = pd.DataFrame.from_records(objs)[["prob","color"]]
         fig = plt.figure(figsize=(4, 4), dpi=180)
         ax = plt.subplot2grid(shape, (0,0), rowspan=shape[0]-2, colspan=shape[0]-2)
-        ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        ax.imshow(fit_to_axes(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), ax), interpolation="nearest", rasterized=True)
         ax.set_xticks([])
         ax.set_yticks([])
         norm = mpl.colors.Normalize(vmin=0, vmax=1)
         ax = plt.subplot2grid(shape, (2,shape[0]-2), rowspan=9, colspan=1)
-        cb1 = mpl.colorbar.ColorbarBase(ax, cmap=cmap,
+        cb1 = mpl.colorbar.ColorbarBase(ax, cmap=get_cmap(cmap) if isinstance(cmap, str) else cmap,
                                         norm=norm,
                                         orientation="vertical")
         cb1.set_label("Pr(CH)")
@@ -13,7 +13,41 @@ __status__ = "Research"
 
 import numpy as np
 import cv2
+import matplotlib
+from functools import lru_cache
 
+@lru_cache(maxsize=1)
+def configure_fonts(family="sans-serif"):
+    """ Global matplotlib font settings, applied once per process """
+    matplotlib.rcParams["font.family"] = family
+    return
+
+@lru_cache(maxsize=32)
+def get_cmap(name):
+    """ Colormap by name, resolved once from the matplotlib registry (matplotlib.cm before 3.5) """
+    if hasattr(matplotlib, "colormaps"): return matplotlib.colormaps[name]
+    import matplotlib.cm
+    return matplotlib.cm.get_cmap(name)
+
+def fit_to_axes(data, ax, oversample=2):
+    """ Stride-decimate an image to ~oversample x the axes size (in pixels) before imshow """
+    target = max(1, int(max(ax.bbox.width, ax.bbox.height) * oversample))
+    step = max(1, min(data.shape[:2]) // target)
+    return data[::step, ::step]
+
+def canvas_to_array(fig, ax=None):
+    """ BGR image of the rendered figure (or of one axes) straight from the Agg buffer """
+    fig.canvas.draw()
+    im = cv2.cvtColor(np.asarray(fig.canvas.buffer_rgba()), cv2.COLOR_RGBA2BGR)
+    if ax is not None:
+        x0, y0, x1, y1 = np.round(ax.get_window_extent().extents).astype(int)
+        im = im[im.shape[0]-y1:im.shape[0]-y0, x0:x1]
+    return im
+
+def save_fast(fig, fname, ax=None, compression=1):
+    """ PNG from the Agg buffer with fast zlib compression, no bbox_inches="tight" dry run """
+    cv2.imwrite(fname, canvas_to_array(fig, ax), [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    return
 
 class BoundaryEstimation(object):
     
@@ -18,7 +18,6 @@ import cv2
 import datetime as dt
 import pandas as pd
 import json
-plt.style.context("seaborn")
 from matplotlib import rcParams
 rcParams["font.family"] = "sans-serif"
 
@@ -250,8 +249,8 @@ class Chrips(object):
         ax.set_ylabel("Y (arcsec)", fontdict={"size":10})
         ax.set_xlabel("X (arcsec)", fontdict={"size":10})
         ax.set_title(title, fontdict={"size":10})
-        if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray")
-        else: ax.imshow(image, extent=[-1024,1024,-1024,1024])
+        if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray", interpolation="nearest", rasterized=True)
+        else: ax.imshow(image, extent=[-1024,1024,-1024,1024], interpolation="nearest", rasterized=True)
         ax.tick_params(axis="both", which="major", labelsize=8)
         ax.set_xticks([-1024,-512,0,512,1024])
         ax.set_yticks([-1024,-512,0,512,1024])
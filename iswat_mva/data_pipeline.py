@@ -10,15 +10,70 @@ __email__ = "shibaji7@vt.edu"
 __status__ = "Research"
 
 import os
+import shutil
+import glob
 import datetime as dt
 import argparse
+import logging
 from dateutil import parser as prs
-from lxml import html
+from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from importlib.util import find_spec
+try: import httpx
+except ImportError: httpx = None
+# HTTP/2 in httpx needs the h2 package
+HAS_HTTP2 = httpx is not None and find_spec("h2") is not None
 
 from to_remote import get_session
 
+log = logging.getLogger(__name__)
+
+SDO_URI = "https://sdo.gsfc.nasa.gov/assets/img/browse/"
+# Concurrent GETs to the SDO host, also the size of the kept-alive connection pool
+DOWNLOAD_WORKERS = 8
+# Validators of the mirrored files; dot-file so that SDOFiles.close() does not wipe it
+SDO_CACHE = "data/SDO-Database/.cache.json"
+_index_session = requests.Session()
+
+@lru_cache(maxsize=64)
+def _index(year, month, day):
+    """ (filenames, hrefs) of the SDO browse index of a day, fetched and parsed once per process """
+    uri = f"{SDO_URI}index.php?b={year:4d}%2F{month:02d}%2F{day:02d}"
+    filenames, hrefs = [], []
+    with _index_session.get(uri, stream=True) as page:
+        # An error page would be cached as an empty day, exceptions are not cached
+        page.raise_for_status()
+        page.raw.decode_content = True
+        # Streaming parse of the anchors only, parsed elements are dropped as we go
+        for _, a in etree.iterparse(page.raw, events=("end",), tag="a", html=True, recover=True):
+            if a.get("class") == "name file" and a.get("href"):
+                filenames.append(a.text)
+                hrefs.append(SDO_URI + a.get("href"))
+            a.clear()
+            while a.getprevious() is not None: del a.getparent()[0]
+    return tuple(filenames), tuple(hrefs)
+
+def _in_event_loop():
+    """ True when called from a running asyncio loop (e.g. a notebook), where asyncio.run cannot be used """
+    try: asyncio.get_running_loop()
+    except RuntimeError: return False
+    return True
+
+_remote_dirs = set()
+
+def _ensure_remote(conn, path):
+    """ Create the remote directory once per (host, path) and process, however many SDOFiles share it """
+    if (conn.host, path) in _remote_dirs: return
+    if not conn.chek_remote_file_exists(path): conn.create_remote_dir(path)
+    _remote_dirs.add((conn.host, path))
+    return
+
 class SDOData(object):
     """ Download datasets from SDO """
     
@@ -44,56 +99,115 @@ class SDOFiles(object):
     def __init__(self, _dict_):
         for p in _dict_.keys():
             setattr(self, p, _dict_[p])
-        self.uri = "https://sdo.gsfc.nasa.gov/assets/img/browse/"
+        self.uri = SDO_URI
+        # One keep-alive session (connection pool) for the index and all the downloads, a blocking
+        # pool of one connection per worker so that every GET goes out on an already open socket
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=DOWNLOAD_WORKERS,
+                                                   pool_block=True, max_retries=3))
         self._fetch_file_list_()
-        self.folder = "data/SDO-Database/{:4d}.{:02d}.{:02d}/{:d}/{:04d}/".format(self.date.year, self.date.month,
-                                                                                  self.date.day, self.resolution, 
-                                                                                  self.wavelength)
-        if not os.path.exists(self.folder): os.system("mkdir -p " + self.folder)
+        self.folder = f"data/SDO-Database/{self.date:%Y.%m.%d}/{self.resolution:d}/{self.wavelength:04d}/"
+        os.makedirs(self.folder, exist_ok=True)
         self.conn = get_session()
+        self._uploads = queue.Queue()
+        self._cache = self._load_cache_()
+        return
+    
+    @staticmethod
+    def _load_cache_():
+        if not os.path.exists(SDO_CACHE): return {}
+        with open(SDO_CACHE, "r") as f: return json.load(f)
+    
+    def _save_cache_(self):
+        tmp = SDO_CACHE + ".tmp"
+        with open(tmp, "w") as f: json.dump(self._cache, f)
+        os.replace(tmp, SDO_CACHE)
+        return
+    
+    def _conditional_headers_(self, fname):
+        """ If-None-Match / If-Modified-Since of a file mirrored in a previous run, the server answers 304 if unchanged """
+        c, headers = self._cache.get(self.folder + fname, {}), {}
+        if c.get("etag"): headers["If-None-Match"] = c["etag"]
+        if c.get("last_modified"): headers["If-Modified-Since"] = c["last_modified"]
+        return headers
+    
+    def _update_cache_(self, fname, headers):
+        self._cache[self.folder + fname] = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
         return
     
     def _fetch_file_list_(self):
-        uri = self.uri + "index.php?b={:4d}%2F{:02d}%2F{:02d}".format(self.date.year,                                                       
-                                                                      self.date.month,
-                                                                      self.date.day)
-        if self.verbose: print(" URI:", uri)
-        page = requests.get(uri)
-        tree = html.fromstring(page.content)
-        self.filenames = tree.xpath("//a[@class=\"name file\"]/text()")
-        self.hrefs = []
-        for a in tree.xpath("//a[@class=\"name file\"]"):
-            items = a.items()
-            for item in items:
-                if item[0] == "href": self.hrefs.append(self.uri + item[1])
+        log.debug("URI: %sindex.php?b=%4d%%2F%02d%%2F%02d", self.uri, self.date.year, self.date.month, self.date.day)
+        self.filenames, self.hrefs = _index(self.date.year, self.date.month, self.date.day)
+        self.tag = f"{self.resolution:d}_{self.wavelength:04d}.jpg"
+        self._matching = [(href, fname) for href, fname in zip(self.hrefs, self.filenames) if href.endswith(self.tag)]
         return
     
     def get_files(self):
-        tag = "{:d}_{:04d}.jpg".format(self.resolution, self.wavelength)
-        filenames = []
-        for href, fname in zip(self.hrefs, self.filenames):
-            if tag in href: filenames.append(fname)
-        return filenames, self.folder
+        return [fname for _, fname in self._matching], self.folder
     
-    def fetch(self):
-        tag = "{:d}_{:04d}.jpg".format(self.resolution, self.wavelength)
-        for href, fname in zip(self.hrefs, self.filenames):
-            if tag in href: self._download_sdo_data_(href, fname)
+    def fetch(self, upload_workers=4):
+        pairs = self._matching
+        if len(pairs) == 0: return self
+        _ensure_remote(self.conn, self.folder)
+        # Downloaded files are queued to the SFTP upload workers, so downloads and uploads overlap
+        with ThreadPoolExecutor(max_workers=upload_workers) as ul:
+            uploaders = [ul.submit(self.conn.upload_worker, self._uploads, True) for _ in range(upload_workers)]
+            try:
+                if HAS_HTTP2 and not _in_event_loop(): asyncio.run(self._fetch_all_(pairs))
+                else:
+                    # Threads release the GIL while waiting on the sockets
+                    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+                        futures = [ex.submit(self._download_sdo_data_, href, fname) for href, fname in pairs]
+                        for f in as_completed(futures): f.result()
+            finally:
+                for _ in uploaders: self._uploads.put(None)
+            for f in uploaders: f.result()
+        # Only persisted once every download made it to the remote
+        self._save_cache_()
         return self
     
+    async def _fetch_all_(self, pairs, limit=DOWNLOAD_WORKERS):
+        """ All the GETs multiplexed as HTTP/2 streams over a single TLS connection """
+        sem = asyncio.Semaphore(limit)
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=30, follow_redirects=True) as client:
+            await asyncio.gather(*[self._download_async_(client, sem, h, fname) for h, fname in pairs])
+        return
+    
+    async def _download_async_(self, client, sem, h, fname):
+        log.debug("Downloading from: %s -to- %s", h, self.folder)
+        loop = asyncio.get_running_loop()
+        async with sem:
+            async with client.stream("GET", h, headers=self._conditional_headers_(fname)) as r:
+                if r.status_code == 304: return
+                r.raise_for_status()
+                f = await loop.run_in_executor(None, open, self.folder + fname, "wb")
+                try:
+                    async for chunk in r.aiter_bytes(1<<16): await loop.run_in_executor(None, f.write, chunk)
+                finally: f.close()
+                self._update_cache_(fname, r.headers)
+        self._uploads.put(self.folder + fname)
+        return
+    
     def close(self):
+        self.session.close()
         self.conn.close()
-        if os.path.exists(self.folder): os.system("rm -rf data/SDO-Database/*")
+        if os.path.exists(self.folder):
+            for p in glob.glob("data/SDO-Database/*"):
+                if os.path.isdir(p): shutil.rmtree(p, ignore_errors=True)
+                else: os.remove(p)
         return
     
     def _download_sdo_data_(self, h, fname):
-        if self.verbose: print(" Downloading from:", h, "-to-", self.folder.replace("data/SDO-Database/",""))
-        r = requests.get(h)
-        with open(self.folder + fname,"wb") as f: f.write(r.content)
-        if not self.conn.chek_remote_file_exists(self.folder): 
-            self.conn.ssh.exec_command("ls -lth LFS/LFS_iSWAT/" + self.folder)
-            self.conn.create_remote_dir(self.folder)
-        self.conn.to_remote_FS(self.folder + fname, is_local_remove=True)
+        log.debug("Downloading from: %s -to- %s", h, self.folder)
+        with self.session.get(h, stream=True, headers=self._conditional_headers_(fname)) as r:
+            r.raise_for_status()
+            if r.status_code == 304: return
+            r.raw.decode_content = True
+            with open(self.folder + fname,"wb") as f: shutil.copyfileobj(r.raw, f, length=1<<16)
+            self._update_cache_(fname, r.headers)
+        self._uploads.put(self.folder + fname)
         return
 
 def fetch_sdo(_dict_):
@@ -110,8 +224,7 @@ def fetch_sdo_data(_dict_):
 
 def fetch_filenames(date, resolution, wavelength):
     """ Fetch file names and dirctory """
-    folder = "data/SDO-Database/{:4d}.{:02d}.{:02d}/{:d}/{:04d}/".format(date.year, date.month, date.day,
-                                                                              resolution, wavelength)
+    folder = f"data/SDO-Database/{date:%Y.%m.%d}/{resolution:d}/{wavelength:04d}/"
     conn = get_session()
     _, stdout, _ = conn.ssh.exec_command("ls LFS/LFS_iSWAT/" + folder)
     files = stdout.read().decode("utf-8").split("\n")[:-1]
@@ -137,6 +250,8 @@ if __name__ == "__main__":
     parser.add_argument("-l", "--loc", default="sdo", help="Database [sdo/sdo.a]", type=str)
     parser.add_argument("-v", "--verbose", action="store_false", help="Increase output verbosity [True]")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=" %(message)s")
+    if args.verbose: log.setLevel(logging.DEBUG)
     _dict_ = {}
     if args.verbose:
         print("\n Parameter list for Bgc simulation ")
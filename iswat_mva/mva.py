@@ -17,7 +17,6 @@ import numpy as np
 import cv2
 import datetime as dt
 import pandas as pd
-plt.style.context("seaborn")
 from matplotlib import rcParams
 rcParams["font.family"] = "sans-serif"
 
@@ -38,8 +37,8 @@ def set_plot_axes(ax, image, title, xlabel="X (pixel)", ylabel="Y (pixel)",
     ax.set_ylabel(ylabel, fontdict={"size":10})
     ax.set_xlabel(xlabel, fontdict={"size":10})
     ax.set_title(title, fontdict={"size":10})
-    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray")
-    else: ax.imshow(image, extent=[-1024,1024,-1024,1024])
+    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray", interpolation="nearest", rasterized=True)
+    else: ax.imshow(image, extent=[-1024,1024,-1024,1024], interpolation="nearest", rasterized=True)
     ax.tick_params(axis="both", which="major", labelsize=8)
     ax.set_xticks(xticks)
     ax.set_yticks(yticks)
@@ -17,7 +17,6 @@ import numpy as np
 import cv2
 import datetime as dt
 import pandas as pd
-plt.style.context("seaborn")
 from matplotlib import rcParams
 rcParams["font.family"] = "sans-serif"
 
@@ -26,6 +25,10 @@ from data_pipeline import fetch_filenames
 import sys
 sys.path.append("core/")
 from cv2_edge_detectors import EdgeDetection
+import astropy.units as u
+from sunpy.net import Fido, attrs
+import sunpy.map
+from aiapy.calibrate import register, update_pointing, normalize_exposure
 
 def write(img, txt, blc, fontScale=3, fontColor = (255,255,255), lineType  = 4):
     font = cv2.FONT_HERSHEY_SIMPLEX    
@@ -36,8 +39,8 @@ def set_axes(ax, image, title, gray_map=False):
     ax.set_ylabel("Y (arcsec)", fontdict={"size":10})
     ax.set_xlabel("X (arcsec)", fontdict={"size":10})
     ax.set_title(title, fontdict={"size":10})
-    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray")
-    else: ax.imshow(image, extent=[-1024,1024,-1024,1024])
+    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray", interpolation="nearest", rasterized=True)
+    else: ax.imshow(image, extent=[-1024,1024,-1024,1024], interpolation="nearest", rasterized=True)
     ax.tick_params(axis="both", which="major", labelsize=8)
     ax.set_xticks([-1024,-512,0,512,1024])
     ax.set_yticks([-1024,-512,0,512,1024])
@@ -49,8 +52,8 @@ def set_plot_axes(ax, image, title, xlabel="X (arcsec)", ylabel="Y (arcsec)",
     ax.set_ylabel(ylabel, fontdict={"size":10})
     ax.set_xlabel(xlabel, fontdict={"size":10})
     ax.set_title(title, fontdict={"size":10})
-    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray")
-    else: ax.imshow(image, extent=[-1024,1024,-1024,1024])
+    if gray_map: ax.imshow(image, extent=[-1024,1024,-1024,1024], cmap="gray", interpolation="nearest", rasterized=True)
+    else: ax.imshow(image, extent=[-1024,1024,-1024,1024], interpolation="nearest", rasterized=True)
     ax.tick_params(axis="both", which="major", labelsize=8)
     ax.set_xticks(xticks)
     ax.set_yticks(yticks)
@@ -237,11 +240,6 @@ def example_beta():
     return
 
 def modulate(date, ux=193):
-    import astropy.units as u
-    from sunpy.net import Fido, attrs
-    import sunpy.map
-
-    from aiapy.calibrate import register, update_pointing, normalize_exposure
     q = Fido.search(
         attrs.Time(date.strftime("%Y-%m-%dT%H:%M:%S"), (date + dt.timedelta(seconds=11)).strftime("%Y-%m-%dT%H:%M:%S")),
         attrs.Instrument("AIA"),
@@ -254,9 +252,6 @@ def modulate(date, ux=193):
     return m_normalized, m
 
 def to_png(date, ux=193, resolution=1024, vmin=10):
-    import matplotlib.pyplot as plt
-    import cv2
-    import os
     folder = "data/SDO-Database/{:4d}.{:02d}.{:02d}/{:d}/{:04d}/".format(date.year, date.month, date.day,
                                                                               resolution, ux)
     if not os.path.exists(folder): os.system("mkdir -p " + folder)
@@ -69,6 +69,18 @@ class Conn2Remote(object):
         if is_local_remove: os.remove(local_file)
         return
     
+    def upload_worker(self, q, is_local_remove=False):
+        """ Upload the files put on queue `q` (until None) over an own SFTP channel of the SSH transport """
+        scp = paramiko.SFTPClient.from_transport(self.ssh.get_transport())
+        try:
+            for local_file in iter(q.get, None):
+                remote_file = LFS + local_file
+                print(" To file:", remote_file)
+                scp.put(local_file, remote_file)
+                if is_local_remove: os.remove(local_file)
+        finally: scp.close()
+        return
+    
     def from_remote_FS(self, local_file):
         remote_file = LFS + local_file
         print(" From file:", remote_file)
@@ -83,8 +95,9 @@ class Conn2Remote(object):
     
     def create_remote_dir(self, ldir):
         rdir = LFS + ldir
-        self.ssh.exec_command("mkdir -p " + rdir)
-        self.ssh.exec_command("ls -lth" + rdir)
+        _, stdout, _ = self.ssh.exec_command("mkdir -p " + rdir)
+        # Wait for mkdir, so that uploads right after do not race it
+        stdout.channel.recv_exit_status()
         return
     
 def encrypt(host, user, filename="data/config/passcode.json"):
@@ -16,9 +16,15 @@ import argparse
 from dateutil import parser as prs
 from lxml import html
 import requests
+from requests.adapters import HTTPAdapter
+import shutil
 import glob
 import numpy as np
 
+# Shared across SDOFile instances to reuse connections (TLS handshakes) between dates
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
 class SDOFile(object):
     """ Class that holds SDO file objects """
     
@@ -39,7 +45,7 @@ class SDOFile(object):
                                                                       self.date.month,
                                                                       self.date.day)
         print(" URI:", uri)
-        page = requests.get(uri)
+        page = session.get(uri, timeout=(5, 60))
         tree = html.fromstring(page.content)
         self.filenames = tree.xpath("//a[@class=\"name file\"]/text()")
         self.hrefs = []
@@ -57,8 +63,10 @@ class SDOFile(object):
     
     def _download_sdo_data_(self, h, fname):
         print(" Downloading from:", h)
-        r = requests.get(h)
-        with open(self.folder + fname,"wb") as f: f.write(r.content)
+        with session.get(h, stream=True, timeout=(5, 60)) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with open(self.folder + fname,"wb") as f: shutil.copyfileobj(r.raw, f, length=1<<20)
         return
 
 def fetch_sdo(_dict_):
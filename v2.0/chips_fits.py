@@ -62,10 +62,7 @@ class CHIPS(object):
     def stage01analysis(self, plot=True):
         rsun = self.aia.m_normalized.rsun_obs.value
         mask = np.zeros_like(self.aia.m_normalized.data)
-        mask[:] = np.nan
-        cv2.circle(mask, (2048,2048), int(rsun/self.rscale), 255, -1)
-        mask[np.isnan(mask)] = 0.
-        mask[mask > 1] = 1.
+        cv2.circle(mask, (2048,2048), int(rsun/self.rscale), 1., -1)
         self.disk_mask = np.copy(mask)
         self.disk_data = mask * self.aia.m_normalized.data
         self.disk_filt_data = mask * signal.medfilt2d(self.aia.m_normalized.data, self._dict_["medfilt.kernel"])
@@ -79,21 +76,21 @@ class CHIPS(object):
             ax.set_xticks([])
             ax.set_yticks([])
             ax = fig.add_subplot(222)
-            ax.imshow(mask, origin="lower", cmap="gray")
+            ax.imshow(mask, origin="lower", cmap="gray", interpolation="nearest", rasterized=True)
             ax.set_xticks([])
             ax.set_yticks([])
             ax = fig.add_subplot(223)
             ux = np.copy(self.disk_data)
             ux[ux <= 0.] = 1
             ux = np.log10(ux)
-            ax.imshow(ux, origin="lower", cmap="gray", vmin=1, vmax=3)
+            ax.imshow(ux, origin="lower", cmap="gray", vmin=1, vmax=3, interpolation="nearest", rasterized=True)
             ax.set_xticks([])
             ax.set_yticks([])
             ax = fig.add_subplot(224)
             ux = np.copy(self.disk_filt_data)
             ux[ux <= 0.] = 1
             ux = np.log10(ux)
-            ax.imshow(ux, origin="lower", cmap="gray", vmin=1, vmax=3)
+            ax.imshow(ux, origin="lower", cmap="gray", vmin=1, vmax=3, interpolation="nearest", rasterized=True)
             ax.set_xticks([])
             ax.set_yticks([])
             fig.subplots_adjust(wspace=0.1, hspace=0.1)